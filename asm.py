@@ -34,160 +34,148 @@ OP = {
 
 REGS = {'A':0, 'B':1}
 
+# register operand as written (either case) -> register number
+_REG_TOKENS = {**REGS, **{r.lower(): n for r, n in REGS.items()}}
+
+# operand kinds per mnemonic: 'r' register, 'v' value (number, char or label)
+OPERANDS = {
+    'NOP': '',
+    'LDI': 'rv',
+    'MOV': 'rv',
+    'STR': 'rv',
+    'ADD': 'rr',
+    'SUB': 'rr',
+    'JMP': 'v',
+    'JZ' : 'v',
+    'JNZ': 'v',
+    'OUT': 'r',
+    'IN' : 'r',
+    'HLT': '',
+}
+
+# mnemonic -> (opcode byte, operand kinds, size in bytes), so the first
+# pass needs a single lookup per instruction
+_ENCODING = {op: (OP[op], kinds, 1 + len(kinds)) for op, kinds in OPERANDS.items()}
+
+# one token: a run of quoted strings (' or ") and characters other than
+# space, tab and comma; an unterminated quote runs to the end of the line
+_TOKEN_RE = re.compile(r'''(?:"[^"]*"?|'[^']*'?|[^ \t,"'])+''')
+
+def split_tokens(code):
+    # code: a line with the comment and outer whitespace already removed
+    return _TOKEN_RE.findall(code)
+
 def tokenize(line):
     # remove comments
     line = line.split(';',1)[0].strip()
     if not line:
         return []
-    # split respecting quotes (both ' and ")
-    tokens = []
-    current = ''
-    in_quote = False
-    quote_char = ''
-    for ch in line:
-        if in_quote:
-            current += ch
-            if ch == quote_char:
-                in_quote = False
-        else:
-            if ch in ('"', "'"):
-                in_quote = True
-                quote_char = ch
-                current += ch
-            elif ch in (' ', '\t', ','):
-                if current:
-                    tokens.append(current)
-                    current = ''
-            else:
-                current += ch
-    if current:
-        tokens.append(current)
-    return tokens
+    return split_tokens(line)
 
 def parse_value(token, labels):
-    # number (hex 0x.. or decimal) or label
+    # number (hex 0x.. or decimal), char literal or label, picked by first char
     token = token.strip()
-    if token.startswith("'") and token.endswith("'") and len(token)==3:
-        return ord(token[1])
-    if token.startswith("0x"):
+    c = token[:1]
+    if c == "'":
+        if len(token) == 3 and token[2] == "'":
+            return ord(token[1])
+    elif c == '0' and token[1:2] == 'x':
         return int(token,16)
-    if token.isdigit() or (token.startswith('-') and token[1:].isdigit()):
-        return int(token,10) & 0xFF
-    if token in labels:
+    elif c.isdigit():
+        if token.isdigit():
+            return int(token,10) & 0xFF
+    elif c == '-':
+        if token[1:].isdigit():
+            return int(token,10) & 0xFF
+    try:
         return labels[token]
-    raise ValueError(f"Unknown value: {token}")
+    except KeyError:
+        raise ValueError(f"Unknown value: {token}") from None
+
+def literal_value(token, cache):
+    # value of a token that doesn't depend on labels, None if it must be a label;
+    # cache: token -> result, kept by the caller for one assemble() call
+    try:
+        return cache[token]
+    except KeyError:
+        pass
+    try:
+        val = parse_value(token, {}) & 0xFF
+    except ValueError:
+        val = None
+    cache[token] = val
+    return val
 
 def assemble(lines):
-    # first pass: labels and DB size
+    # lines: any iterable of source lines, e.g. an open file
+    # first pass: labels, sizes and operand decoding
     labels = {}
+    literals = {}   # cache for literal_value
     pc = 0
     parsed = []
+    encoding = _ENCODING; reg_tokens = _REG_TOKENS   # locals for the loop
     for raw in lines:
-        line = raw.strip()
-        if not line or line.startswith(';'):
+        # drop the comment once here, split_tokens doesn't look for one
+        code = raw.split(';',1)[0].strip()
+        if not code:
             continue
-        if line.endswith(':'):
-            lbl = line[:-1].strip()
+        if code.endswith(':'):
+            lbl = code[:-1].strip()
             labels[lbl] = pc
             continue
-        toks = tokenize(line)
+        toks = split_tokens(code)
         if not toks: continue
         op = toks[0].upper()
-        parsed.append((pc, op, toks[1:]))
-        # estimate size
+        addr = pc
         if op == 'DB':
-            # count of following values (split by commas already removed)
-            args = ' '.join(toks[1:]).split(',')
-            pc += len(args)
-        elif op in ('LDI', 'MOV', 'STR'):
-            pc += 3
-        elif op in ('ADD','SUB'):
-            pc += 3
-        elif op in ('JMP','JZ','JNZ'):
-            pc += 2
-        elif op in ('OUT','IN'):
-            pc += 2
-        elif op in ('NOP','HLT'):
-            pc += 1
-        else:
-            raise ValueError(f"Unknown op {op}")
+            # one byte per value, one per character of a "string"
+            for tok in toks[1:]:
+                if tok.startswith('"') and tok.endswith('"'):
+                    pc += len(tok[1:-1])
+                else:
+                    pc += 1
+            parsed.append((addr, None, toks[1:]))
+            continue
+        try:
+            opcode, kinds, size = encoding[op]
+        except KeyError:
+            raise ValueError(f"Unknown op {op}") from None
+        pc += size
+        # operands become register numbers, byte values, or label names
+        # that are resolved once all labels are known
+        args = []
+        for i, kind in enumerate(kinds, 1):
+            tok = toks[i]
+            if kind == 'r':
+                reg = reg_tokens.get(tok)
+                if reg is None:
+                    reg = REGS[tok.upper()]   # KeyError for unknown registers
+                args.append(reg)
+            else:
+                val = literal_value(tok, literals)
+                args.append(tok if val is None else val)
+        parsed.append((addr, opcode, args))
     # second pass: generate bytes
-    out = []
-    for (addr, op, args) in parsed:
-        o = op.upper()
-        if o == 'DB':
-            # args might be comma separated in one token; handle split by comma
-            data_tokens = []
-            for a in args:
-                data_tokens.extend([x for x in a.split(',') if x!=''])
-            for tok in data_tokens:
-                tok = tok.strip()
+    out = bytearray()
+    for (addr, opcode, args) in parsed:
+        if opcode is None:
+            # DB: tokenize already split the values, commas left are inside strings
+            for tok in args:
                 if tok.startswith('"') and tok.endswith('"'):
                     s = tok[1:-1]
-                    for ch in s:
-                        out.append(ord(ch) & 0xFF)
+                    try:
+                        out += s.encode('latin-1')
+                    except UnicodeEncodeError:
+                        # keep the low byte of characters above 0xFF
+                        out.extend(ord(ch) & 0xFF for ch in s)
                 else:
                     out.append(parse_value(tok, labels) & 0xFF)
             continue
-        if o == 'LDI':
-            # LDI A, imm
-            reg = args[0].strip().rstrip(',').upper()
-            imm = args[1].strip()
-            out.append(OP['LDI'])
-            out.append(REGS[reg])
-            out.append(parse_value(imm, labels) & 0xFF)
-            continue
-        if o == 'MOV':
-            # MOV A, addr
-            reg = args[0].strip().rstrip(',').upper()
-            addr_tok = args[1].strip()
-            out.append(OP['MOV'])
-            out.append(REGS[reg])
-            out.append(parse_value(addr_tok, labels) & 0xFF)
-            continue
-        if o == 'STR':
-            reg = args[0].strip().rstrip(',').upper()
-            addr_tok = args[1].strip()
-            out.append(OP['STR'])
-            out.append(REGS[reg])
-            out.append(parse_value(addr_tok, labels) & 0xFF)
-            continue
-        if o == 'ADD':
-            r1 = args[0].strip().rstrip(',').upper()
-            r2 = args[1].strip().upper()
-            out.append(OP['ADD'])
-            out.append(REGS[r1])
-            out.append(REGS[r2])
-            continue
-        if o == 'SUB':
-            r1 = args[0].strip().rstrip(',').upper()
-            r2 = args[1].strip().upper()
-            out.append(OP['SUB'])
-            out.append(REGS[r1])
-            out.append(REGS[r2])
-            continue
-        if o in ('JMP','JZ','JNZ'):
-            out.append(OP[o])
-            addr_tok = args[0].strip()
-            out.append(parse_value(addr_tok, labels) & 0xFF)
-            continue
-        if o == 'OUT':
-            reg = args[0].strip().upper()
-            out.append(OP['OUT'])
-            out.append(REGS[reg])
-            continue
-        if o == 'IN':
-            reg = args[0].strip().upper()
-            out.append(OP['IN'])
-            out.append(REGS[reg])
-            continue
-        if o == 'NOP':
-            out.append(OP['NOP'])
-            continue
-        if o == 'HLT':
-            out.append(OP['HLT'])
-            continue
-        raise ValueError(f"Unhandled op {o}")
+        out.append(opcode)
+        for a in args:
+            if isinstance(a, str):
+                a = parse_value(a, labels) & 0xFF
+            out.append(a)
     return bytes(out)
 
 def main():
@@ -196,12 +184,12 @@ def main():
     parser.add_argument("-o","--outfile", default="out.bin")
     args = parser.parse_args()
     with open(args.infile, "r") as f:
-        lines = f.readlines()
-    try:
-        data = assemble(lines)
-    except Exception as e:
-        print("Assembly error:", e)
-        sys.exit(1)
+        # assemble only iterates its input, so lines are read as needed
+        try:
+            data = assemble(f)
+        except Exception as e:
+            print("Assembly error:", e)
+            sys.exit(1)
     with open(args.outfile, "wb") as f:
         f.write(data)
     print(f"Wrote {len(data)} bytes to {args.outfile}")
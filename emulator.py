@@ -15,7 +15,17 @@ Features:
 import sys
 import argparse
 
+try:
+    # optional: JIT-compiled run loop (see run_core)
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
 RAM_SIZE = 256
+# PC and addresses wrap with '& 0xFF', which relies on this
+assert RAM_SIZE == 256
 
 # Opcodes
 OP = {
@@ -33,129 +43,495 @@ OP = {
     'HLT': 0xFF,
 }
 
+# Instruction length in bytes (opcode + operands); unknown opcodes count as 1
+INSTR_LEN = [1]*256
+for _op in ('LDI', 'MOV', 'STR', 'ADD', 'SUB'):
+    INSTR_LEN[OP[_op]] = 3
+for _op in ('JMP', 'JZ', 'JNZ', 'OUT', 'IN'):
+    INSTR_LEN[OP[_op]] = 2
+
+# Opcodes that end a basic block: anything that can move PC somewhere else,
+# stop the CPU, or rewrite code (STR)
+ENDS_BLOCK = [True]*256
+for _op in ('NOP', 'LDI', 'MOV', 'ADD', 'SUB', 'OUT', 'IN'):
+    ENDS_BLOCK[OP[_op]] = False
+
 REG_A = 0
 REG_B = 1
 
+OUT_BUF_SIZE = 4096      # OUT bytes held back before writing them to stdout
+IN_BUF_SIZE = 4096       # most chars read from stdin at once for IN
+JIT_BUDGET = 1 << 20     # instructions per run_core call, keeps Ctrl-C working
+PROGRAM_CACHE_SIZE = 64  # translated programs kept, see CPU._program
+
+# (RAM contents, start) -> function built by gen_program, or None
+_programs = {}
+
+run_core = None
+try:
+    # optional: Cython build of the run loop, see emulator_core.pyx
+    from emulator_core import run_core
+except ImportError:
+    pass
+
+if run_core is None and njit is not None:
+    _NOP, _LDI, _MOV, _STR = OP['NOP'], OP['LDI'], OP['MOV'], OP['STR']
+    _ADD, _SUB, _JMP, _JZ = OP['ADD'], OP['SUB'], OP['JMP'], OP['JZ']
+    _JNZ, _OUT = OP['JNZ'], OP['OUT']
+
+    @njit(cache=True)
+    def run_core(ram, reg, pc, zero, out_buf, budget):
+        """
+        Native version of the CPU loop over uint8 arrays.
+        Stops in front of anything it leaves to CPU.step (HLT, IN, unknown
+        opcodes, bad register numbers, OUT with a full out_buf) or after
+        `budget` instructions.
+        Returns (pc, zero, out_len, stopped).
+        """
+        out_len = 0
+        while budget > 0:
+            budget -= 1
+            op = ram[pc]
+            a = ram[(pc + 1) & 0xFF]
+            b = ram[(pc + 2) & 0xFF]
+            if op == _NOP:
+                pc = (pc + 1) & 0xFF
+            elif op == _LDI or op == _MOV:
+                if a > 1:
+                    return pc, zero, out_len, True
+                reg[a] = b if op == _LDI else ram[b]
+                zero = reg[0] == 0
+                pc = (pc + 3) & 0xFF
+            elif op == _STR:
+                if a > 1:
+                    return pc, zero, out_len, True
+                ram[b] = reg[a]
+                pc = (pc + 3) & 0xFF
+            elif op == _ADD or op == _SUB:
+                if a > 1 or b > 1:
+                    return pc, zero, out_len, True
+                if op == _ADD:
+                    reg[0] = (int(reg[a]) + int(reg[b])) & 0xFF
+                else:
+                    reg[0] = (int(reg[a]) - int(reg[b])) & 0xFF
+                zero = reg[0] == 0
+                pc = (pc + 3) & 0xFF
+            elif op == _JMP:
+                pc = int(a)
+            elif op == _JZ:
+                pc = int(a) if zero else (pc + 2) & 0xFF
+            elif op == _JNZ:
+                pc = (pc + 2) & 0xFF if zero else int(a)
+            elif op == _OUT:
+                if a > 1 or out_len == out_buf.shape[0]:
+                    return pc, zero, out_len, True
+                out_buf[out_len] = reg[a]
+                out_len += 1
+                pc = (pc + 2) & 0xFF
+            else:
+                return pc, zero, out_len, True
+        return pc, zero, out_len, False
+
+def gen_program(ram, start):
+    """
+    Translate the code reachable from start into the source of a Python
+    function `program` that runs it with registers and the zero flag in
+    locals and one `if pc == ...` branch per jump target.
+    Returns None for programs that can't be translated up front: STR into
+    reachable code (self-modifying) or register numbers other than A/B.
+    """
+    names = {v: k for k, v in OP.items()}
+    # reachable instructions: addr -> (name, a, b, next addr)
+    instrs = {}
+    leaders = {start}
+    todo = [start]
+    while todo:
+        p = todo.pop()
+        if p in instrs:
+            continue
+        opcode = ram[p]
+        name = names.get(opcode)
+        x = ram[(p+1) & 0xFF]; y = ram[(p+2) & 0xFF]
+        nxt = (p + INSTR_LEN[opcode]) & 0xFF
+        instrs[p] = (name, x, y, nxt)
+        if name in ('LDI', 'MOV', 'STR', 'OUT', 'IN') and x > 1:
+            return None
+        if name in ('ADD', 'SUB') and (x > 1 or y > 1):
+            return None
+        if name in ('JMP', 'JZ', 'JNZ'):
+            leaders.add(x)
+            todo.append(x)
+        if name in ('JZ', 'JNZ'):
+            leaders.add(nxt)
+        if name not in ('JMP', 'HLT', None):
+            todo.append(nxt)
+    code = set()
+    for p in instrs:
+        for i in range(INSTR_LEN[ram[p]]):
+            code.add((p+i) & 0xFF)
+    for name, x, y, nxt in instrs.values():
+        if name == 'STR' and y in code:
+            return None
+
+    r = ('a', 'b')
+    blocks = {}
+    pending = sorted(leaders)
+    while pending:
+        start_pc = pending.pop()
+        if start_pc in blocks:
+            continue
+        body = []
+        dirty = False   # z not yet updated to a == 0
+        seen = set()
+        p = start_pc
+        while True:
+            if p in seen or (p != start_pc and p in leaders):
+                if p not in leaders:
+                    # straight-line code wrapped around into itself
+                    leaders.add(p)
+                    pending.append(p)
+                if dirty:
+                    body.append("z = a == 0")
+                body.append(f"pc = {p}")
+                break
+            seen.add(p)
+            name, x, y, nxt = instrs[p]
+            if name == 'LDI':
+                body.append(f"{r[x]} = {y}")
+            elif name == 'MOV':
+                body.append(f"{r[x]} = ram[{y}]")
+            elif name == 'STR':
+                body.append(f"ram[{y}] = {r[x]}")
+            elif name == 'ADD':
+                body.append(f"a = ({r[x]} + {r[y]}) & 0xFF")
+            elif name == 'SUB':
+                body.append(f"a = ({r[x]} - {r[y]}) & 0xFF")
+            elif name == 'OUT':
+                body.append(f"out.append({r[x]})")
+                body.append(f"if len(out) >= {OUT_BUF_SIZE}: flush()")
+            elif name == 'IN':
+                body.append(f"{r[x]} = read_byte()")
+            dirty = dirty or name in ('LDI', 'MOV', 'ADD', 'SUB', 'IN')
+            if name in ('NOP', 'LDI', 'MOV', 'STR', 'ADD', 'SUB', 'OUT', 'IN'):
+                p = nxt
+                continue
+            if dirty:
+                body.append("z = a == 0")
+            if name == 'JMP':
+                body.append(f"pc = {x}")
+            elif name in ('JZ', 'JNZ') and x == start_pc:
+                # block loops on itself: run it as a Python loop
+                exit_if = "z" if name == 'JNZ' else "not z"
+                body = ["while True:"] + ["    " + line for line in body]
+                body.append(f"    if {exit_if}: break")
+                body.append(f"pc = {nxt}")
+            elif name == 'JZ':
+                body.append(f"pc = {x} if z else {nxt}")
+            elif name == 'JNZ':
+                body.append(f"pc = {nxt} if z else {x}")
+            else:
+                # HLT or unknown opcode: hand the state back to the CPU
+                body.append(f"cpu.pc = {nxt}; reg[0] = a; reg[1] = b; cpu.zero = z")
+                if name is None:
+                    body.append("cpu._op_illegal(0, 0)")
+                body.append("return")
+            break
+        blocks[start_pc] = body
+
+    lines = [
+        "def program(cpu, ram, reg, out, flush, read_byte):",
+        "    a, b = reg",
+        "    z = cpu.zero",
+        f"    pc = {start}",
+        "    while True:",
+    ]
+    kw = "if"
+    for start_pc in sorted(blocks):
+        lines.append(f"        {kw} pc == {start_pc}:")
+        lines.extend("            " + line for line in blocks[start_pc])
+        kw = "elif"
+    return "\n".join(lines) + "\n"
+
 class CPU:
     def __init__(self):
-        self.ram = [0]*RAM_SIZE
-        self.reg = [0,0]   # A, B
+        self.ram = bytearray(RAM_SIZE)
+        # A, B. A list on purpose: values stay 0-255, which CPython keeps as
+        # shared small ints, and list indexing beats both bytearray indexing
+        # and separate a/b attributes in the handlers
+        self.reg = [0,0]
         self.pc = 0
         self.zero = False
         self.running = False
         self.trace = False
+        self._out = bytearray()   # pending OUT bytes, see flush_out
+        self._in_buf = ''         # stdin read ahead for IN, see _read_byte
+        self._in_pos = 0
+        # opcode -> handler, indexed directly by the fetched byte
+        self._handlers = [self._op_illegal]*256
+        self._handlers[OP['NOP']] = self._op_nop
+        self._handlers[OP['LDI']] = self._op_ldi
+        self._handlers[OP['MOV']] = self._op_mov
+        self._handlers[OP['STR']] = self._op_str
+        self._handlers[OP['ADD']] = self._op_add
+        self._handlers[OP['SUB']] = self._op_sub
+        self._handlers[OP['JMP']] = self._op_jmp
+        self._handlers[OP['JZ']] = self._op_jz
+        self._handlers[OP['JNZ']] = self._op_jnz
+        self._handlers[OP['OUT']] = self._op_out
+        self._handlers[OP['IN']] = self._op_in
+        self._handlers[OP['HLT']] = self._op_hlt
+        # decoded basic blocks by start address, and which bytes they cover
+        self._blocks = [None]*RAM_SIZE
+        self._is_code = bytearray(RAM_SIZE)
 
     def load_bin(self, data, addr=0):
-        for i, b in enumerate(data):
-            self.ram[(addr + i) % RAM_SIZE] = b & 0xFF
+        n = len(data)
+        if n > RAM_SIZE:
+            # wrapped bytes overwrite earlier ones, only the last RAM_SIZE stay
+            addr += n - RAM_SIZE
+            data = data[-RAM_SIZE:]
+            n = RAM_SIZE
+        addr &= 0xFF
+        split = min(n, RAM_SIZE - addr)
+        self.ram[addr:addr+split] = data[:split]
+        self.ram[:n-split] = data[split:]
+        self._flush_blocks()
+
+    def _flush_blocks(self):
+        # in place, run loops hold a reference to the list
+        self._blocks[:] = [None]*RAM_SIZE
+        self._is_code[:] = bytes(RAM_SIZE)
+
+    def _decode_block(self, pc):
+        """
+        Decode the straight-line code starting at pc.
+        Returns (body, last, a, b, next_pc): body is a list of
+        (handler, a, b) that never touch PC, last is the handler of the
+        instruction that ends the block (None if the block was cut at
+        RAM_SIZE instructions) and next_pc the address after it.
+        """
+        ram = self.ram; is_code = self._is_code
+        body = []
+        for _ in range(RAM_SIZE):
+            opcode = ram[pc]
+            n = INSTR_LEN[opcode]
+            for i in range(n):
+                is_code[(pc+i) & 0xFF] = 1
+            a = ram[(pc+1) & 0xFF]; b = ram[(pc+2) & 0xFF]
+            pc = (pc + n) & 0xFF
+            if ENDS_BLOCK[opcode]:
+                return body, self._handlers[opcode], a, b, pc
+            body.append((self._handlers[opcode], a, b))
+        return body, None, 0, 0, pc
 
     def step(self):
-        opcode = self.ram[self.pc]
         if self.trace:
-            print(f"[PC={self.pc:02X}] OPCODE {opcode:02X}")
-        self.pc = (self.pc + 1) % RAM_SIZE
-
-        if opcode == OP['NOP']:
-            return True
-
-        if opcode == OP['LDI']:
-            reg = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            imm = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            self.reg[reg] = imm & 0xFF
-            self.zero = (self.reg[REG_A] == 0)
-            return True
-
-        if opcode == OP['MOV']:
-            reg = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            addr = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            self.reg[reg] = self.ram[addr]
-            self.zero = (self.reg[REG_A] == 0)
-            return True
-
-        if opcode == OP['STR']:
-            reg = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            addr = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            self.ram[addr] = self.reg[reg] & 0xFF
-            return True
-
-        if opcode == OP['ADD']:
-            r1 = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            r2 = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            self.reg[REG_A] = (self.reg[r1] + self.reg[r2]) & 0xFF
-            self.zero = (self.reg[REG_A] == 0)
-            return True
-
-        if opcode == OP['SUB']:
-            r1 = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            r2 = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            self.reg[REG_A] = (self.reg[r1] - self.reg[r2]) & 0xFF
-            self.zero = (self.reg[REG_A] == 0)
-            return True
-
-        if opcode == OP['JMP']:
-            addr = self.ram[self.pc]; self.pc = addr % RAM_SIZE
-            return True
-
-        if opcode == OP['JZ']:
-            addr = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            if self.zero:
-                self.pc = addr % RAM_SIZE
-            return True
-
-        if opcode == OP['JNZ']:
-            addr = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            if not self.zero:
-                self.pc = addr % RAM_SIZE
-            return True
-
-        if opcode == OP['OUT']:
-            reg = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            sys.stdout.write(chr(self.reg[reg] & 0xFF))
-            sys.stdout.flush()
-            return True
+            return self._step_trace()
+        return self._step_fast()
 
-        if opcode == OP['IN']:
-            reg = self.ram[self.pc]; self.pc = (self.pc+1)%RAM_SIZE
-            ch = sys.stdin.read(1)
-            if ch == '':
-                val = 0
-            else:
-                val = ord(ch[0])
-            self.reg[reg] = val & 0xFF
-            self.zero = (self.reg[REG_A] == 0)
-            return True
+    def _step_fast(self):
+        pc = self.pc; ram = self.ram
+        opcode = ram[pc]
+        self.pc = (pc + INSTR_LEN[opcode]) & 0xFF
+        return self._handlers[opcode](ram[(pc+1) & 0xFF], ram[(pc+2) & 0xFF])
+
+    def _step_trace(self):
+        self.flush_out()
+        print(f"[PC={self.pc:02X}] OPCODE {self.ram[self.pc]:02X}")
+        return self._step_fast()
+
+    # Handlers get the two bytes following the opcode; PC already points
+    # past the instruction, jumps overwrite it.
 
-        if opcode == OP['HLT']:
-            return False
+    def _op_nop(self, a, b):
+        return True
 
+    def _op_ldi(self, reg, imm):
+        r = self.reg
+        r[reg] = imm
+        self.zero = (r[REG_A] == 0)
+        return True
+
+    def _op_mov(self, reg, addr):
+        r = self.reg
+        r[reg] = self.ram[addr]
+        self.zero = (r[REG_A] == 0)
+        return True
+
+    def _op_str(self, reg, addr):
+        self.ram[addr] = self.reg[reg]
+        if self._is_code[addr]:
+            self._flush_blocks()   # self-modifying code, decode again
+        return True
+
+    def _op_add(self, r1, r2):
+        r = self.reg
+        r[REG_A] = (r[r1] + r[r2]) & 0xFF
+        self.zero = (r[REG_A] == 0)
+        return True
+
+    def _op_sub(self, r1, r2):
+        r = self.reg
+        r[REG_A] = (r[r1] - r[r2]) & 0xFF
+        self.zero = (r[REG_A] == 0)
+        return True
+
+    def _op_jmp(self, addr, b):
+        self.pc = addr
+        return True
+
+    def _op_jz(self, addr, b):
+        if self.zero:
+            self.pc = addr
+        return True
+
+    def _op_jnz(self, addr, b):
+        if not self.zero:
+            self.pc = addr
+        return True
+
+    def _op_out(self, reg, b):
+        self._out.append(self.reg[reg])
+        if len(self._out) >= OUT_BUF_SIZE:
+            self.flush_out()
+        return True
+
+    def _read_byte(self):
+        if self._in_pos >= len(self._in_buf):
+            self.flush_out()   # show any prompt before blocking on input
+            # a line at a time from the text layer, which input() in the
+            # monitor shares, instead of one read(1) per IN
+            self._in_buf = sys.stdin.readline(IN_BUF_SIZE)
+            self._in_pos = 0
+            if not self._in_buf:
+                return 0
+        ch = self._in_buf[self._in_pos]
+        self._in_pos += 1
+        return ord(ch) & 0xFF
+
+    def _op_in(self, reg, b):
+        r = self.reg
+        r[reg] = self._read_byte()
+        self.zero = (r[REG_A] == 0)
+        return True
+
+    def _op_hlt(self, a, b):
+        self.flush_out()
+        return False
+
+    def _op_illegal(self, a, b):
         # Unknown opcode
-        print(f"Unknown opcode {opcode:02X} at {self.pc-1:02X}")
+        self.flush_out()
+        at = (self.pc - 1) & 0xFF
+        print(f"Unknown opcode {self.ram[at]:02X} at {at:02X}")
         return False
 
     def run(self, start=0, trace=False):
-        self.pc = start % RAM_SIZE
+        self.pc = start & 0xFF
         self.trace = trace
         self.running = True
+        try:
+            if run_core is not None and not trace:
+                self._run_jit()
+            elif trace:
+                while self._step_trace():
+                    pass
+            else:
+                program = self._program(self.pc)
+                if program is not None:
+                    try:
+                        program(self, self.ram, self.reg, self._out, self.flush_out, self._read_byte)
+                    finally:
+                        # its STRs don't check self._is_code, so decoded
+                        # blocks may be stale now
+                        self._flush_blocks()
+                else:
+                    self._run_blocks()
+        finally:
+            self.flush_out()
+        self.running = False
+
+    def _program(self, start):
+        # translated program for the current RAM contents, None if it has
+        # to be interpreted
+        key = (bytes(self.ram), start)
+        try:
+            return _programs[key]
+        except KeyError:
+            pass
+        src = gen_program(self.ram, start)
+        program = None
+        if src is not None:
+            ns = {}
+            exec(compile(src, f"<program at {start:02X}>", "exec"), ns)
+            program = ns['program']
+        if len(_programs) >= PROGRAM_CACHE_SIZE:
+            _programs.clear()
+        _programs[key] = program
+        return program
+
+    def _run_blocks(self):
+        # run decoded basic blocks, decoding each one the first time it's hit
+        blocks = self._blocks
         while True:
-            cont = self.step()
-            if not cont:
+            pc = self.pc
+            block = blocks[pc]
+            if block is None:
+                block = blocks[pc] = self._decode_block(pc)
+            body, last, a, b, next_pc = block
+            for fn, x, y in body:
+                fn(x, y)
+            self.pc = next_pc
+            if last is not None and not last(a, b):
                 break
-        self.running = False
+
+    def flush_out(self):
+        # chars as chr() gives them, so bytes >= 0x80 print as before
+        if self._out:
+            text = self._out.decode('latin-1')
+            self._out.clear()   # don't retry a failed write from run()
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def _run_jit(self):
+        reg = bytearray(self.reg)
+        out_buf = bytearray(OUT_BUF_SIZE)
+        # run_core works in place on these; numba wants numpy views of
+        # them, the Cython build takes any byte buffer
+        bufs = (self.ram, reg, out_buf)
+        if np is not None:
+            bufs = [np.frombuffer(buf, dtype=np.uint8) for buf in bufs]
+        ram_v, reg_v, out_v = bufs
+        while True:
+            pc, zero, n, stopped = run_core(ram_v, reg_v, self.pc, self.zero, out_v, JIT_BUDGET)
+            self.pc = int(pc)
+            self.zero = bool(zero)
+            self.reg[:] = reg
+            if n:
+                self._out += out_buf[:n]
+                if len(self._out) >= OUT_BUF_SIZE:
+                    self.flush_out()
+            if stopped:
+                # HLT, IN and the error cases go through the Python handlers
+                if not self._step_fast():
+                    break
+                reg[:] = bytes(self.reg)
 
     def dump_regs(self):
         print(f"PC: {self.pc:02X}  A: {self.reg[0]:02X}  B: {self.reg[1]:02X}  Z:{int(self.zero)}")
 
     def dump_mem(self, start=0, length=32):
-        for addr in range(start, start+length):
-            a = addr % RAM_SIZE
-            if (a-start)%16==0:
-                print(f"\n{a:02X}: ", end='')
-            print(f"{self.ram[a]:02X} ", end='')
-        print()
+        # RAM rotated to begin at start, repeated if the dump wraps around
+        s = start & 0xFF
+        mem = (self.ram[s:] + self.ram[:s]) * (length // RAM_SIZE + 1)
+        rows = []
+        for i in range(0, length, 16):
+            rows.append(f"\n{(start + i) & 0xFF:02X}: {mem[i:min(i+16, length)].hex(' ').upper()} ")
+        print(''.join(rows))
 
 def load_file_bytes(path):
     with open(path, "rb") as f:
-        return list(f.read())
+        return f.read()
 
 def repl(cpu):
     print("8bit emulator monitor. Type 'help' for commands.")
@@ -187,6 +563,7 @@ def repl(cpu):
             continue
         if parts[0] == "step":
             ok = cpu.step()
+            cpu.flush_out()
             cpu.dump_regs()
             if not ok:
                 print("[Halted]")
@@ -0,0 +1,76 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled run loop for the 8-bit emulator (optional).
+Build it next to emulator.py with:
+  pip install cython
+  cythonize -i emulator_core.pyx
+emulator.py uses it when the import works, same contract as the numba
+run_core there.
+"""
+
+# must match OP in emulator.py
+cdef enum:
+    NOP = 0x00
+    LDI = 0x10
+    MOV = 0x11
+    STR = 0x12
+    ADD = 0x20
+    SUB = 0x21
+    JMP = 0x30
+    JZ  = 0x31
+    JNZ = 0x32
+    OUT = 0x40
+
+def run_core(unsigned char[::1] ram, unsigned char[::1] reg, int pc, bint zero,
+             unsigned char[::1] out_buf, long budget):
+    """
+    Run from pc until the next instruction needs the Python side (HLT, IN,
+    unknown opcodes, bad register numbers, OUT with a full out_buf) or
+    `budget` instructions have executed.
+    Returns (pc, zero, out_len, stopped).
+    """
+    cdef int op, a, b
+    cdef Py_ssize_t out_len = 0
+    cdef Py_ssize_t out_size = out_buf.shape[0]
+    while budget > 0:
+        budget -= 1
+        op = ram[pc]
+        a = ram[(pc + 1) & 0xFF]
+        b = ram[(pc + 2) & 0xFF]
+        if op == NOP:
+            pc = (pc + 1) & 0xFF
+        elif op == LDI or op == MOV:
+            if a > 1:
+                return pc, zero, out_len, True
+            reg[a] = b if op == LDI else ram[b]
+            zero = reg[0] == 0
+            pc = (pc + 3) & 0xFF
+        elif op == STR:
+            if a > 1:
+                return pc, zero, out_len, True
+            ram[b] = reg[a]
+            pc = (pc + 3) & 0xFF
+        elif op == ADD or op == SUB:
+            if a > 1 or b > 1:
+                return pc, zero, out_len, True
+            if op == ADD:
+                reg[0] = (reg[a] + reg[b]) & 0xFF
+            else:
+                reg[0] = (reg[a] - reg[b]) & 0xFF
+            zero = reg[0] == 0
+            pc = (pc + 3) & 0xFF
+        elif op == JMP:
+            pc = a
+        elif op == JZ:
+            pc = a if zero else (pc + 2) & 0xFF
+        elif op == JNZ:
+            pc = (pc + 2) & 0xFF if zero else a
+        elif op == OUT:
+            if a > 1 or out_len == out_size:
+                return pc, zero, out_len, True
+            out_buf[out_len] = reg[a]
+            out_len += 1
+            pc = (pc + 2) & 0xFF
+        else:
+            return pc, zero, out_len, True
+    return pc, zero, out_len, False